@@ -0,0 +1,121 @@
+import atexit
+import threading
+import time
+import logging
+from typing import Dict, Optional
+from psycopg2 import extensions, extras, pool
+
+class CachingConnectionPool(pool.ThreadedConnectionPool):
+    """Thread-safe pool that keeps returned connections warm and closes long-idle ones"""
+
+    def __init__(self, minconn: int, maxconn: int, idle_timeout: float = 300.0, *args, **kwargs):
+        self.idle_timeout = idle_timeout
+        self._idle_since: Dict[int, float] = {}
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._stop_reaper = threading.Event()
+        self._reaper = threading.Thread(target=self._reap_loop, name="pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        # Decode json/jsonb columns (EXPLAIN FORMAT JSON) straight to Python objects
+        extras.register_default_json(conn)
+        extras.register_default_jsonb(conn)
+        if key is None:
+            self._idle_since[id(conn)] = time.monotonic()
+        return conn
+
+    def _getconn(self, key=None):
+        conn = super()._getconn(key)
+        self._idle_since.pop(id(conn), None)
+        return conn
+
+    def _putconn(self, conn, key=None, close=False):
+        # The stock pool closes anything beyond minconn; keep up to maxconn warm
+        # instead and leave trimming to the idle reaper
+        if self.closed:
+            raise pool.PoolError("connection pool is closed")
+
+        if key is None:
+            key = self._rused.get(id(conn))
+            if key is None:
+                raise pool.PoolError("trying to put unkeyed connection")
+
+        if not close and not conn.closed and len(self._pool) < self.maxconn:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                conn.close()
+            else:
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                self._pool.append(conn)
+                self._idle_since[id(conn)] = time.monotonic()
+        else:
+            conn.close()
+
+        if key in self._used:
+            del self._used[key]
+            del self._rused[id(conn)]
+
+    def reap_idle(self) -> int:
+        """Close idle connections beyond minconn that exceeded idle_timeout"""
+        closed = 0
+        now = time.monotonic()
+        with self._lock:
+            if self.closed:
+                return 0
+            for conn in list(self._pool):
+                if conn.closed:
+                    self._pool.remove(conn)
+                    self._idle_since.pop(id(conn), None)
+                    continue
+                if len(self._pool) <= self.minconn:
+                    break
+                if now - self._idle_since.get(id(conn), now) > self.idle_timeout:
+                    self._pool.remove(conn)
+                    self._idle_since.pop(id(conn), None)
+                    conn.close()
+                    closed += 1
+        return closed
+
+    def _reap_loop(self) -> None:
+        interval = max(self.idle_timeout / 2, 1.0)
+        while not self._stop_reaper.wait(interval):
+            self.reap_idle()
+
+    def closeall(self) -> None:
+        self._stop_reaper.set()
+        super().closeall()
+
+_pool: Optional[CachingConnectionPool] = None
+_pool_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+def init_pool(host: str, port: int, dbname: str, user: str, password: str,
+              minconn: int = 1, maxconn: int = 8, idle_timeout: float = 300.0) -> CachingConnectionPool:
+    """Create the module-level connection pool once and return it"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = CachingConnectionPool(
+                minconn, maxconn, idle_timeout,
+                host=host, port=port, dbname=dbname, user=user, password=password
+            )
+            logger.info("Database connection pool initialized")
+        return _pool
+
+def get_pool() -> Optional[CachingConnectionPool]:
+    """Return the active connection pool, if one has been initialized"""
+    return _pool
+
+def close_pool() -> None:
+    """Close every pooled connection and discard the pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+            logger.info("Database connection pool closed")
+        _pool = None
+
+# Drain the pool at interpreter exit instead of relying on object finalizers
+atexit.register(close_pool)
@@ -1,11 +1,27 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 import json
-from typing import Dict, Any, Optional
-import psycopg2
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.collections import LineCollection
 import networkx as nx
+import numpy as np
+try:
+    import pygraphviz  # noqa: F401 - only needed for graphviz_layout
+    HAS_PYGRAPHVIZ = True
+except ImportError:
+    HAS_PYGRAPHVIZ = False
+from preprocessing import QueryPreprocessor, DatabaseConfig
+from config import init_pool, get_pool
+
+# Operators the what-if edit control can force onto a plan node
+OPERATOR_TYPES = (
+    'Hash Join', 'Merge Join', 'Nested Loop',
+    'Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan',
+)
 
 class LoginWindow(tk.Toplevel):
     def __init__(self, parent, callback):
@@ -48,19 +64,30 @@ class LoginWindow(tk.Toplevel):
     
     def connect(self):
         try:
-            conn = psycopg2.connect(
+            pool = init_pool(
                 host=self.entries['host'].get(),
                 port=self.entries['port'].get(),
                 dbname=self.entries['database'].get(),
                 user=self.entries['username'].get(),
                 password=self.entries['password'].get()
             )
+            conn = pool.getconn()
+        except Exception as e:
+            messagebox.showerror("Connection Error", str(e))
+            return
+        
+        try:
             self.callback(conn)
-            self.destroy()
         except Exception as e:
+            # Hand the connection back so failed attempts cannot drain the pool
+            pool.putconn(conn)
             messagebox.showerror("Connection Error", str(e))
+            return
+        self.destroy()
 
 class QueryPlanAnalyzer(tk.Tk):
+    LAYOUT_CACHE_SIZE = 64
+
     def __init__(self):
         super().__init__()
         
@@ -70,6 +97,10 @@ class QueryPlanAnalyzer(tk.Tk):
         self.qep_data = None
         self.aqp_data = None
         self.connection = None
+        self.preprocessor = None
+        self.after_login_callback = None
+        self.db_lock = threading.Lock()
+        self._layout_cache: Dict[tuple, Dict[Any, Tuple[float, float]]] = {}
         
         # Center the main window
         screen_width = self.winfo_screenwidth()
@@ -78,14 +109,31 @@ class QueryPlanAnalyzer(tk.Tk):
         y = (screen_height - 800) // 2
         self.geometry(f"1200x800+{x}+{y}")
         
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        
         # Show login window
         self.withdraw()
         self.login_window = LoginWindow(self, self.on_login_success)
         
     def on_login_success(self, connection):
         self.connection = connection
-        self.create_widgets()  # Create widgets before showing the window
-        self.deiconify()      # Show the main window
+        self.preprocessor = QueryPreprocessor(DatabaseConfig(
+            host=connection.info.host,
+            port=connection.info.port,
+            dbname=connection.info.dbname,
+            user=connection.info.user,
+            password=connection.info.password
+        ))
+        self.preprocessor.connection = connection
+        try:
+            if self.after_login_callback:
+                self.after_login_callback(connection)
+        except Exception as e:
+            # A failing hook must not keep the main window from appearing
+            messagebox.showerror("Error", f"Error during setup: {str(e)}")
+        finally:
+            self.create_widgets()  # Create widgets before showing the window
+            self.deiconify()      # Show the main window
         
     def create_widgets(self):
         # Create main container
@@ -108,6 +156,19 @@ class QueryPlanAnalyzer(tk.Tk):
                                      command=self.generate_query_plan)
         self.generate_btn.pack(pady=10)
         
+        # Operator edit: pick a QEP node and the operator to force in its place
+        operator_frame = ttk.LabelFrame(left_panel, text="Modify Operator")
+        operator_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        self.operator_node = ttk.Combobox(operator_frame, state='readonly')
+        self.operator_node.pack(fill=tk.X, padx=5, pady=2)
+        
+        self.operator_type = ttk.Combobox(operator_frame, state='readonly', values=OPERATOR_TYPES)
+        self.operator_type.pack(fill=tk.X, padx=5, pady=2)
+        
+        ttk.Button(operator_frame, text="Apply", 
+                   command=self.request_operator_change).pack(pady=5)
+        
         # Right panel with notebook for QEP and AQP
         right_panel = ttk.Notebook(main_container)
         main_container.add(right_panel)
@@ -131,6 +192,10 @@ class QueryPlanAnalyzer(tk.Tk):
         self.aqp_cost_label = ttk.Label(cost_frame, text="Modified AQP Cost: N/A")
         self.aqp_cost_label.pack(side=tk.LEFT, padx=20, pady=5)
         
+        # Plan structure summary from the complexity analysis
+        self.metrics_label = ttk.Label(cost_frame, text="Joins: N/A")
+        self.metrics_label.pack(side=tk.LEFT, padx=20, pady=5)
+        
         # Initialize visualization
         self.setup_tree_visualization()
 
@@ -139,73 +204,197 @@ class QueryPlanAnalyzer(tk.Tk):
         self.qep_figure = Figure(figsize=(6, 4))
         self.qep_canvas = FigureCanvasTkAgg(self.qep_figure, self.qep_frame)
         self.qep_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.qep_ax = self.qep_figure.add_subplot(111)
         
         self.aqp_figure = Figure(figsize=(6, 4))
         self.aqp_canvas = FigureCanvasTkAgg(self.aqp_figure, self.aqp_frame)
         self.aqp_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.aqp_ax = self.aqp_figure.add_subplot(111)
+        
+        # Persistent artists, updated in place on every redraw
+        self.plan_artists = {
+            True: self._create_plan_artists(self.qep_ax),
+            False: self._create_plan_artists(self.aqp_ax),
+        }
+
+    def _create_plan_artists(self, ax) -> Dict[str, Any]:
+        """Create empty node/edge/label artists for a plan axes"""
+        ax.set_axis_off()
+        edges = LineCollection([], colors='k', linewidths=1.0, zorder=1)
+        ax.add_collection(edges)
+        nodes = ax.scatter([], [], s=1500, c='lightblue', zorder=2)
+        return {'nodes': nodes, 'edges': edges, 'labels': []}
 
     def generate_query_plan(self):
-        """Generate query plan from input SQL"""
-        sql = self.query_text.get("1.0", tk.END).strip()
-        if not sql:
+        """Hand the input SQL to the application through the <<Generate>> event"""
+        if not self.query_text.get("1.0", tk.END).strip():
             return
-            
-        try:
-            # Get query plan from PostgreSQL
-            with self.connection.cursor() as cur:
-                cur.execute(f"EXPLAIN (FORMAT JSON) {sql}")
-                self.qep_data = cur.fetchone()[0]
-            self.visualize_plan(self.qep_data, is_qep=True)
-            self.update_cost_labels()
-        except Exception as e:
-            messagebox.showerror("Error", f"Error generating query plan: {str(e)}")
+        
+        # Re-enabled by the application once the plan (or an error) is shown
+        self.generate_btn.state(['disabled'])
+        self.event_generate('<<Generate>>')
+
+    def request_operator_change(self):
+        """Ask the application to apply the selected operator edit via <<OperatorChange>>"""
+        node_id, new_type = self.selected_operator_edit()
+        if node_id and new_type:
+            self.event_generate('<<OperatorChange>>')
+
+    def selected_operator_edit(self) -> Tuple[str, str]:
+        """Return the (node id, operator type) chosen in the operator edit control"""
+        return self.operator_node.get().split(':', 1)[0], self.operator_type.get()
 
     def visualize_plan(self, plan_data: Dict[str, Any], is_qep: bool = True):
         """Visualize query plan as a tree using networkx and matplotlib"""
         G = nx.DiGraph()
-        figure = self.qep_figure if is_qep else self.aqp_figure
+        ax = self.qep_ax if is_qep else self.aqp_ax
         canvas = self.qep_canvas if is_qep else self.aqp_canvas
-        
-        # Clear previous visualization
-        figure.clear()
+        artists = self.plan_artists[is_qep]
         
         # Create graph from plan data
-        self.build_plan_graph(G, plan_data[0]['Plan'], None)
+        self.build_plan_graph(G, plan_data['Plan'], None)
+        pos = self.compute_layout(G)
+        
+        # Move the existing artists instead of rebuilding the figure
+        nodes = list(G)
+        coords = np.array([pos[node] for node in nodes], dtype=float).reshape(-1, 2)
+        artists['nodes'].set_offsets(coords)
+        artists['edges'].set_segments([(pos[u], pos[v]) for u, v in G.edges()])
+        
+        labels = artists['labels']
+        while len(labels) < len(nodes):
+            labels.append(ax.text(0, 0, '', fontsize=8, fontweight='bold',
+                                  ha='center', va='center', zorder=3))
+        while len(labels) > len(nodes):
+            labels.pop().remove()
+        for text, node, xy in zip(labels, nodes, coords):
+            text.set_position(xy)
+            text.set_text(G.nodes[node]['label'])
         
-        # Draw the graph
-        ax = figure.add_subplot(111)
-        pos = nx.spring_layout(G)
-        nx.draw(G, pos, ax=ax, with_labels=True, node_color='lightblue',
-                node_size=1500, font_size=8, font_weight='bold')
+        if is_qep:
+            # Offer the QEP's nodes, by graph id, to the operator edit control
+            self.operator_node.config(values=[f"{node}: {G.nodes[node]['label']}" for node in nodes])
+            self.operator_node.set('')
         
-        canvas.draw()
+        if len(coords):
+            (x_min, y_min), (x_max, y_max) = coords.min(axis=0), coords.max(axis=0)
+            x_pad = max((x_max - x_min) * 0.1, 0.5)
+            y_pad = max((y_max - y_min) * 0.1, 0.5)
+            ax.set_xlim(x_min - x_pad, x_max + x_pad)
+            ax.set_ylim(y_min - y_pad, y_max + y_pad)
+        
+        canvas.draw_idle()
 
-    def build_plan_graph(self, G: nx.DiGraph, node: Dict[str, Any], parent_id: str):
-        """Recursively build networkx graph from plan data"""
-        node_id = f"{node['Node Type']}_{id(node)}"
-        G.add_node(node_id, label=node['Node Type'])
+    def compute_layout(self, G: nx.DiGraph) -> Dict[Any, Tuple[float, float]]:
+        """Lay out the plan tree top-down"""
+        # Edges in insertion (plan) order describe the shape including child order,
+        # whichever numbering build_plan_graph used
+        struct_key = (G.number_of_nodes(), tuple(G.edges()))
+        pos = self._layout_cache.get(struct_key)
+        if pos is not None:
+            return pos
+        
+        # build_plan_graph always produces a tree, so no force-directed fallback is needed
+        if HAS_PYGRAPHVIZ:
+            pos = nx.nx_agraph.graphviz_layout(G, prog='dot')
+        else:
+            pos = self._hierarchical_layout(G)
+        
+        if len(self._layout_cache) >= self.LAYOUT_CACHE_SIZE:
+            self._layout_cache.pop(next(iter(self._layout_cache)))
+        self._layout_cache[struct_key] = pos
+        return pos
+
+    @staticmethod
+    def _hierarchical_layout(G: nx.DiGraph) -> Dict[Any, Tuple[float, float]]:
+        """O(n) tree layout: y from depth, x from the centre of each subtree's leaf span"""
+        root = next(n for n, degree in G.in_degree() if degree == 0)
+        
+        # Preorder walk recording depth; children keep insertion (plan) order
+        order = []
+        depth = {root: 0}
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            order.append(current)
+            children = list(G.successors(current))
+            for child in children:
+                depth[child] = depth[current] + 1
+            stack.extend(reversed(children))
         
-        if parent_id:
-            G.add_edge(parent_id, node_id)
+        # Leaf counts bottom-up give each subtree its horizontal width
+        width = {}
+        for current in reversed(order):
+            width[current] = sum(width[child] for child in G.successors(current)) or 1
+        
+        # Hand each child a consecutive slice of its parent's span
+        start = {root: 0}
+        pos = {}
+        for current in order:
+            offset = start[current]
+            pos[current] = (offset + width[current] / 2, -depth[current])
+            for child in G.successors(current):
+                start[child] = offset
+                offset += width[child]
+        return pos
+
+    def build_plan_graph(self, G: nx.DiGraph, node: Dict[str, Any], parent_id: Optional[int]):
+        """Build networkx graph from plan data in one BFS pass with bulk inserts"""
+        # Plans stamped by QueryPlanModifier keep their '_nid' as the graph id, so a
+        # node clicked here is the node the modifier edits; unstamped plans get ids in
+        # BFS order. The operator name lives in the 'label' attribute
+        next_id = G.number_of_nodes()
+        nodes = []
+        edges = []
+        queue = deque([(node, parent_id)])
+        
+        while queue:
+            current, parent = queue.popleft()
+            node_id = current.get('_nid')
+            if node_id is None:
+                node_id = next_id
+                next_id += 1
+            nodes.append((node_id, {'label': current['Node Type']}))
+            if parent is not None:
+                edges.append((parent, node_id))
             
-        if 'Plans' in node:
-            for child in node['Plans']:
-                self.build_plan_graph(G, child, node_id)
+            queue.extend((child, node_id) for child in current.get('Plans', ()))
+        
+        G.add_nodes_from(nodes)
+        G.add_edges_from(edges)
 
     def update_cost_labels(self):
         """Update cost comparison labels"""
         if self.qep_data:
-            qep_cost = self.qep_data[0]['Plan'].get('Total Cost', 'N/A')
+            qep_cost = self.qep_data['Plan'].get('Total Cost', 'N/A')
             self.qep_cost_label.config(text=f"Original QEP Cost: {qep_cost}")
             
         if self.aqp_data:
-            aqp_cost = self.aqp_data[0]['Plan'].get('Total Cost', 'N/A')
+            aqp_cost = self.aqp_data['Plan'].get('Total Cost', 'N/A')
             self.aqp_cost_label.config(text=f"Modified AQP Cost: {aqp_cost}")
 
-    def __del__(self):
-        if self.connection:
-            self.connection.close()
+    def update_metrics_display(self, metrics: Dict[str, Any]):
+        """Show the complexity metrics of the current QEP"""
+        tables = ', '.join(sorted(metrics.get('tables_involved', []))) or 'none'
+        index_count = sum(len(indexes) for indexes in metrics.get('indexes', {}).values())
+        self.metrics_label.config(text=(
+            f"Joins: {metrics.get('number_of_joins', 0)}  "
+            f"Scans: {len(metrics.get('scan_types', []))}  "
+            f"Tables: {tables}  "
+            f"Indexes: {index_count}"
+        ))
 
-if __name__ == "__main__":
-    app = QueryPlanAnalyzer()
-    app.mainloop()
\ No newline at end of file
+    def _on_close(self):
+        """Hand the connection back to the pool before tearing down the window"""
+        # Wait for any in-flight EXPLAIN; the pool rolls back what it is handed
+        with self.db_lock:
+            if self.preprocessor:
+                self.preprocessor.disconnect()
+            elif self.connection:
+                pool = get_pool()
+                if pool:
+                    pool.putconn(self.connection)
+                else:
+                    self.connection.close()
+            self.connection = None
+        self.destroy()
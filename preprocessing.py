@@ -1,9 +1,27 @@
 import psycopg2
+import psycopg2.errors
 from typing import Dict, Any, List, Optional, Tuple
-import json
+from collections import OrderedDict
+import hashlib
 import logging
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import init_pool, get_pool
 from dataclasses import dataclass
 from enum import Enum
+try:
+    import sqlglot
+    HAS_SQLGLOT = True
+except ImportError:
+    HAS_SQLGLOT = False
+try:
+    from cachetools import LFUCache
+    HAS_CACHETOOLS = True
+except ImportError:
+    HAS_CACHETOOLS = False
 
 class JoinType(Enum):
     HASH = "Hash Join"
@@ -15,6 +33,39 @@ class ScanType(Enum):
     INDEX = "Index Scan"
     BITMAP = "Bitmap Scan"
 
+JOIN_TYPES = frozenset(join_type.value for join_type in JoinType)
+
+# Leading EXPLAIN/DESCRIBE wrapper, with either a parenthesised option list or the
+# legacy bare ANALYZE/VERBOSE keywords
+_EXPLAIN_PREFIX = re.compile(
+    r"^\s*(EXPLAIN|DESCRIBE|DESC)(\s*\([^)]*\)|(\s+(ANALYZE|ANALYSE|VERBOSE)\b)+)?\s+",
+    re.IGNORECASE
+)
+
+# Spans whose text must survive normalization verbatim: E'' strings with backslash
+# escapes, plain and $tag$ dollar-quoted literals, quoted identifiers and comments
+# (pg_hint_plan hints live in the latter)
+_VERBATIM_SPAN = re.compile(
+    r"(?<![\w$])[Ee]'(?:[^'\\]|\\.|'')*(?:'|\Z)"
+    r"|'(?:[^']|'')*(?:'|\Z)"
+    r"|(?<![\w$])\$((?:[A-Za-z_]\w*)?)\$.*?(?:\$\1\$|\Z)"
+    r"|\"(?:[^\"]|\"\")*(?:\"|\Z)"
+    r"|/\*.*?(?:\*/|\Z)"
+    r"|--[^\n]*\n?",
+    re.DOTALL
+)
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and case outside literals, quoted identifiers and comments"""
+    parts = []
+    pos = 0
+    for match in _VERBATIM_SPAN.finditer(sql):
+        parts.append(re.sub(r"\s+", " ", sql[pos:match.start()]).lower())
+        parts.append(match.group())
+        pos = match.end()
+    parts.append(re.sub(r"\s+", " ", sql[pos:]).lower())
+    return "".join(parts).strip()
+
 @dataclass
 class DatabaseConfig:
     host: str
@@ -23,10 +74,50 @@ class DatabaseConfig:
     user: str
     password: str
 
+# Fingerprint of the public schema; changes on CREATE/DROP/ALTER/TRUNCATE of relations
+_SCHEMA_FINGERPRINT_QUERY = """
+SELECT md5(coalesce(string_agg(c.oid::text || ':' || c.relfilenode || ':' || c.relnatts, ',' ORDER BY c.oid), ''))
+FROM pg_class c
+WHERE c.relnamespace = 'public'::regnamespace;
+"""
+
+# pg_catalog equivalent of information_schema.columns, much cheaper to evaluate
+_TABLE_METADATA_PREPARE = """
+PREPARE table_metadata AS
+SELECT c.relname, array_agg(a.attname::text ORDER BY a.attnum)
+FROM pg_class c
+JOIN pg_attribute a ON a.attrelid = c.oid
+WHERE c.relkind = 'r'
+  AND c.relnamespace = 'public'::regnamespace
+  AND a.attnum > 0
+  AND NOT a.attisdropped
+GROUP BY c.relname;
+"""
+
 class QueryPreprocessor:
-    def __init__(self, config: DatabaseConfig):
+    PLAN_CACHE_SIZE = 512
+    COMPLEXITY_MEMO_SIZE = 64
+
+    def __init__(self, config: DatabaseConfig, replan_interval: float = 300.0,
+                 schema_poll_interval: float = 30.0):
         self.config = config
         self.connection = None
+        self.replan_interval = replan_interval
+        self.schema_poll_interval = schema_poll_interval
+        self.schema_version = 0
+        self._schema_fingerprint = None
+        self._schema_checked_at = None
+        # LFU keeps frequently re-explained queries; plain LRU when cachetools is missing
+        self._plan_cache = LFUCache(maxsize=self.PLAN_CACHE_SIZE) if HAS_CACHETOOLS else OrderedDict()
+        # id(plan) -> (plan, metrics), bounded LRU; holding the plan keeps its id from
+        # being reused, and get_query_plan hands out the same object on cache hits
+        self._complexity_memo: "OrderedDict[int, Tuple[Dict[str, Any], Dict[str, Any]]]" = OrderedDict()
+        self._index_cache: Dict[frozenset, Dict[str, List[Dict[str, Any]]]] = {}
+        self._cache_lock = threading.RLock()
+        self._table_metadata: Optional[Dict[str, List[str]]] = None
+        self._table_metadata_version = None
+        self._metadata_prepared_on = None
+        self._prefetch_executor: Optional[ThreadPoolExecutor] = None
         self._setup_logging()
 
     def _setup_logging(self):
@@ -37,119 +128,343 @@ class QueryPreprocessor:
         self.logger = logging.getLogger(__name__)
 
     def connect(self) -> None:
-        """Establish database connection"""
+        """Borrow a database connection from the shared pool"""
         try:
-            self.connection = psycopg2.connect(
+            pool = init_pool(
                 host=self.config.host,
                 port=self.config.port,
                 dbname=self.config.dbname,
                 user=self.config.user,
                 password=self.config.password
             )
+            self.connection = pool.getconn()
             self.logger.info("Successfully connected to database")
         except Exception as e:
             self.logger.error(f"Failed to connect to database: {str(e)}")
             raise
 
     def disconnect(self) -> None:
-        """Close database connection"""
+        """Return the database connection to the pool"""
+        if self._prefetch_executor is not None:
+            # cancel_futures is only understood from Python 3.9 on
+            if sys.version_info >= (3, 9):
+                self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                self._prefetch_executor.shutdown(wait=False)
+            self._prefetch_executor = None
         if self.connection:
-            self.connection.close()
-            self.logger.info("Database connection closed")
+            pool = get_pool()
+            if pool:
+                pool.putconn(self.connection)
+            else:
+                self.connection.close()
+            self.connection = None
+            self.logger.info("Database connection released")
 
     def get_table_metadata(self) -> Dict[str, List[str]]:
         """Retrieve metadata about tables and their columns"""
+        self.check_schema_version()
+        if self._table_metadata is not None and self._table_metadata_version == self.schema_version:
+            return self._table_metadata
+
         if not self.connection:
             self.connect()
 
-        query = """
-        SELECT 
-            table_name,
-            array_agg(column_name::text) as columns
-        FROM 
-            information_schema.columns
-        WHERE 
-            table_schema = 'public'
-        GROUP BY 
-            table_name;
-        """
-
         try:
             with self.connection.cursor() as cursor:
-                cursor.execute(query)
+                self._prepare_table_metadata(cursor)
+                cursor.execute("EXECUTE table_metadata")
                 results = cursor.fetchall()
-                return {table: columns for table, columns in results}
         except Exception as e:
             self.logger.error(f"Error fetching table metadata: {str(e)}")
             raise
 
+        self._table_metadata = {table: columns for table, columns in results}
+        self._table_metadata_version = self.schema_version
+        return self._table_metadata
+
+    def _prepare_table_metadata(self, cursor) -> None:
+        """PREPARE the catalog metadata query once per session"""
+        if self._metadata_prepared_on is self.connection:
+            return
+
+        # The statement may survive from an earlier borrower of this pooled connection
+        cursor.execute("SAVEPOINT prepare_table_metadata")
+        try:
+            cursor.execute(_TABLE_METADATA_PREPARE)
+        except psycopg2.Error as e:
+            # Any failure aborts the transaction; unwind it before deciding what to do
+            cursor.execute("ROLLBACK TO SAVEPOINT prepare_table_metadata; RELEASE SAVEPOINT prepare_table_metadata")
+            if not isinstance(e, psycopg2.errors.DuplicatePreparedStatement):
+                raise
+        else:
+            cursor.execute("RELEASE SAVEPOINT prepare_table_metadata")
+        self._metadata_prepared_on = self.connection
+
+    @staticmethod
+    def _strip_explain(sql: str) -> str:
+        """Remove a leading EXPLAIN wrapper and its options so only the inner query remains"""
+        return _EXPLAIN_PREFIX.sub("", sql, count=1)
+
+    @classmethod
+    def _normalize_sql(cls, sql: str) -> str:
+        """Collapse whitespace and case after dropping any EXPLAIN prefix"""
+        return normalize_sql(cls._strip_explain(sql))
+
+    @classmethod
+    def _plan_cache_key(cls, sql: str, format_json: bool = True) -> str:
+        """Hash a normalized SQL string into a plan cache key; quoted text keeps its case"""
+        normalized = cls._normalize_sql(sql)
+        if format_json:
+            normalized = "json:" + normalized
+        return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
+
+    @classmethod
+    def _ast_cache_key(cls, sql: str, format_json: bool = True) -> Optional[str]:
+        """Hash the canonical sqlglot rendering so semantically equal queries share a key"""
+        # pg_hint_plan hints live in comments, which the canonical form drops
+        if not HAS_SQLGLOT or "/*+" in sql:
+            return None
+        try:
+            canonical = sqlglot.parse_one(cls._strip_explain(sql), read='postgres').sql(
+                dialect='postgres', normalize=True, comments=False
+            )
+        except Exception:
+            # sqlglot does not understand every Postgres construct; fall back to text keys
+            return None
+        if format_json:
+            canonical = "json:" + canonical
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+    def _get_plan_cached(self, sql_hash: str) -> Optional[Any]:
+        """Return a cached plan if present and younger than replan_interval"""
+        with self._cache_lock:
+            entry = self._plan_cache.get(sql_hash)
+            if entry is None:
+                return None
+
+            plan, timestamp = entry
+            if time.monotonic() - timestamp > self.replan_interval:
+                del self._plan_cache[sql_hash]
+                return None
+
+            if isinstance(self._plan_cache, OrderedDict):
+                self._plan_cache.move_to_end(sql_hash)
+            return plan
+
+    def _store_plan(self, sql_hash: str, plan: Any) -> None:
+        """Insert a plan into the cache; LFUCache evicts on its own, the LRU fallback here"""
+        with self._cache_lock:
+            self._plan_cache[sql_hash] = (plan, time.monotonic())
+            if isinstance(self._plan_cache, OrderedDict):
+                self._plan_cache.move_to_end(sql_hash)
+                if len(self._plan_cache) > self.PLAN_CACHE_SIZE:
+                    self._plan_cache.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Drop all cached plans, e.g. after DDL changes the schema"""
+        with self._cache_lock:
+            self._plan_cache.clear()
+            self._complexity_memo.clear()
+            self._index_cache.clear()
+            self.schema_version += 1
+
+    def check_schema_version(self, force: bool = False) -> int:
+        """Poll the catalog fingerprint and invalidate caches when the schema changed"""
+        now = time.monotonic()
+        if not force and self._schema_checked_at is not None \
+                and now - self._schema_checked_at < self.schema_poll_interval:
+            return self.schema_version
+
+        if not self.connection:
+            self.connect()
+
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(_SCHEMA_FINGERPRINT_QUERY)
+                fingerprint = cursor.fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"Error checking schema version: {str(e)}")
+            raise
+
+        self._schema_checked_at = now
+        if self._schema_fingerprint is not None and fingerprint != self._schema_fingerprint:
+            self.logger.info("Schema change detected, invalidating plan cache")
+            self.invalidate()
+        self._schema_fingerprint = fingerprint
+        return self.schema_version
+
     def get_query_plan(self, sql: str, format_json: bool = True) -> Dict[str, Any]:
         """Get the query execution plan for a given SQL query"""
+        # Callers may pass an already EXPLAIN-wrapped query; plan the inner statement
+        sql = self._strip_explain(sql)
+        self.check_schema_version()
+
+        # First level: normalized text; second level: canonical AST
+        sql_hash = self._plan_cache_key(sql, format_json)
+        cached = self._get_plan_cached(sql_hash)
+        if cached is not None:
+            return cached
+
+        ast_hash = self._ast_cache_key(sql, format_json)
+        if ast_hash is not None:
+            cached = self._get_plan_cached(ast_hash)
+            if cached is not None:
+                self._store_plan(sql_hash, cached)
+                return cached
+
         if not self.connection:
             self.connect()
 
         try:
             with self.connection.cursor() as cursor:
-                explain_query = f"EXPLAIN ({'FORMAT JSON' if format_json else ''}) {sql}"
-                cursor.execute(explain_query)
-                plan = cursor.fetchone()[0]
-                return json.loads(plan[0]) if format_json else plan
+                plan = self._explain(cursor, sql, format_json)
         except Exception as e:
             self.logger.error(f"Error getting query plan: {str(e)}")
             raise
 
+        self._store_plan(sql_hash, plan)
+        if ast_hash is not None:
+            self._store_plan(ast_hash, plan)
+        return plan
+
+    @staticmethod
+    def _explain(cursor, sql: str, format_json: bool = True) -> Any:
+        """Run EXPLAIN for sql on the given cursor and return the plan"""
+        options = "FORMAT JSON, BUFFERS OFF, VERBOSE OFF" if format_json else "BUFFERS OFF, VERBOSE OFF"
+        cursor.execute(f"EXPLAIN ({options}) {sql}")
+        plan = cursor.fetchone()[0]
+        # The json column is already decoded by psycopg2's json typecaster
+        return plan[0] if format_json else plan
+
+    def prefetch_query_plans(self, sqls: List[str]) -> None:
+        """Speculatively EXPLAIN queries in the background so later lookups hit the cache"""
+        if get_pool() is None:
+            return
+        if self._prefetch_executor is None:
+            self._prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="plan-prefetch")
+        for sql in sqls:
+            self._prefetch_executor.submit(self._prefetch_plan, sql)
+
+    def _prefetch_plan(self, sql: str) -> None:
+        """Worker: plan sql on its own pooled connection and store it in the cache"""
+        sql = self._strip_explain(sql)
+        sql_hash = self._plan_cache_key(sql)
+        schema_version = self.schema_version
+        if self._get_plan_cached(sql_hash) is not None:
+            return
+
+        pool = get_pool()
+        if pool is None:
+            return
+
+        try:
+            conn = pool.getconn()
+            try:
+                with conn.cursor() as cursor:
+                    plan = self._explain(cursor, sql)
+            finally:
+                pool.putconn(conn)
+        except Exception as e:
+            self.logger.warning(f"Speculative plan fetch failed: {str(e)}")
+            return
+
+        # Drop the result if the schema changed while it was being planned
+        with self._cache_lock:
+            if self.schema_version == schema_version:
+                self._store_plan(sql_hash, plan)
+
     def validate_sql(self, sql: str) -> Tuple[bool, Optional[str]]:
         """Validate SQL query syntax and structure"""
         if not sql.strip():
             return False, "Empty query"
 
+        sql = self._strip_explain(sql)
+        validity_key = "valid:" + self._plan_cache_key(sql)
+
         try:
+            # Poll the schema like get_query_plan does, so DDL drops stale verdicts
+            self.check_schema_version()
+            cached = self._get_plan_cached(validity_key)
+            if cached is not None:
+                return cached
+
             with self.connection.cursor() as cursor:
-                # Parse query without executing
-                cursor.execute(f"EXPLAIN {sql}")
-                return True, None
+                # PREPARE parses and analyzes the query but skips planning. The whole
+                # check goes out as one round trip; only a failure costs a second one
+                # to unwind the savepoint and keep the open transaction usable
+                try:
+                    cursor.execute(
+                        "SAVEPOINT validate_sql; "
+                        # Newline so a trailing -- comment cannot swallow the rest
+                        f"PREPARE validate_sql_stmt AS {sql}\n; "
+                        "DEALLOCATE validate_sql_stmt; "
+                        "RELEASE SAVEPOINT validate_sql"
+                    )
+                    result = (True, None)
+                except psycopg2.Error as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT validate_sql; RELEASE SAVEPOINT validate_sql")
+                    result = (False, str(e))
         except psycopg2.Error as e:
             return False, str(e)
         except Exception as e:
             return False, f"Unexpected error: {str(e)}"
 
+        # Only successes are cached: a rejected query may become valid as soon as
+        # the user creates the missing table, before the next schema poll
+        if result[0]:
+            self._store_plan(validity_key, result)
+        return result
+
     def analyze_query_complexity(self, plan: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze query plan complexity and structure"""
-        metrics = {
-            'join_types': [],
-            'scan_types': [],
-            'total_cost': 0,
-            'number_of_joins': 0,
-            'tables_involved': set(),
-        }
+        with self._cache_lock:
+            entry = self._complexity_memo.get(id(plan))
+            if entry is not None and entry[0] is plan:
+                self._complexity_memo.move_to_end(id(plan))
+                return self._copy_metrics(entry[1])
+
+        joins = []
+        scans = []
+        tables = set()
+        total_cost = 0
 
-        def traverse_plan(node: Dict[str, Any]):
+        # Explicit preorder stack; every node is visited once and results go
+        # into flat lists, so the walk stays linear on deep left-deep plans
+        stack = [plan['Plan']]
+        while stack:
+            node = stack.pop()
             node_type = node.get('Node Type', '')
-            
-            # Track join operations
-            if 'Join' in node_type:
-                metrics['join_types'].append(node_type)
-                metrics['number_of_joins'] += 1
 
-            # Track scan operations
+            if node_type in JOIN_TYPES:
+                joins.append(node_type)
             if 'Scan' in node_type:
-                metrics['scan_types'].append(node_type)
+                scans.append(node_type)
                 if 'Relation Name' in node:
-                    metrics['tables_involved'].add(node['Relation Name'])
+                    tables.add(node['Relation Name'])
+            total_cost = max(total_cost, node.get('Total Cost', 0))
 
-            # Track costs
-            metrics['total_cost'] = max(
-                metrics['total_cost'],
-                node.get('Total Cost', 0)
-            )
+            stack.extend(reversed(node.get('Plans', ())))
 
-            # Recurse through child plans
-            for child in node.get('Plans', []):
-                traverse_plan(child)
+        metrics = {
+            'join_types': joins,
+            'scan_types': scans,
+            'total_cost': total_cost,
+            'number_of_joins': len(joins),
+            'tables_involved': list(tables),
+        }
+        with self._cache_lock:
+            self._complexity_memo[id(plan)] = (plan, metrics)
+            self._complexity_memo.move_to_end(id(plan))
+            if len(self._complexity_memo) > self.COMPLEXITY_MEMO_SIZE:
+                self._complexity_memo.popitem(last=False)
+        return self._copy_metrics(metrics)
 
-        traverse_plan(plan['Plan'])
-        metrics['tables_involved'] = list(metrics['tables_involved'])
-        return metrics
+    @staticmethod
+    def _copy_metrics(metrics: Dict[str, Any]) -> Dict[str, Any]:
+        """Give callers their own lists so they cannot corrupt the memoized result"""
+        return {key: list(value) if isinstance(value, list) else value
+                for key, value in metrics.items()}
 
     def extract_planner_hints(self, sql: str) -> List[str]:
         """Extract any existing planner hints from the SQL query"""
@@ -160,8 +475,18 @@ class QueryPreprocessor:
 
     def get_available_indexes(self, table_name: str) -> List[Dict[str, Any]]:
         """Get information about available indexes for a table"""
+        return self.get_all_indexes([table_name]).get(table_name, [])
+
+    def get_all_indexes(self, tables: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Get index information for several tables in a single round trip"""
+        cache_key = frozenset(tables)
+        cached = self._index_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         query = """
         SELECT 
+            i.tablename,
             i.indexname,
             array_agg(a.attname::text) as columns,
             ix.indisunique as is_unique
@@ -172,23 +497,36 @@ class QueryPreprocessor:
             JOIN pg_attribute a ON a.attrelid = ix.indrelid 
             AND a.attnum = ANY(ix.indkey)
         WHERE 
-            i.tablename = %s
+            i.tablename = ANY(%s)
         GROUP BY 
-            i.indexname, ix.indisunique;
+            i.tablename, i.indexname, ix.indisunique;
         """
+
+        if not self.connection:
+            self.connect()
         
         try:
             with self.connection.cursor() as cursor:
-                cursor.execute(query, (table_name,))
-                results = cursor.fetchall()
-                return [
-                    {
-                        'name': name,
-                        'columns': columns,
-                        'unique': is_unique
-                    }
-                    for name, columns, is_unique in results
-                ]
+                # Same savepoint pattern as validate_sql: a failure here must not
+                # leave the shared connection's transaction aborted
+                cursor.execute("SAVEPOINT get_all_indexes")
+                try:
+                    cursor.execute(query, (list(cache_key),))
+                    results = cursor.fetchall()
+                except psycopg2.Error:
+                    cursor.execute("ROLLBACK TO SAVEPOINT get_all_indexes; RELEASE SAVEPOINT get_all_indexes")
+                    raise
+                cursor.execute("RELEASE SAVEPOINT get_all_indexes")
         except Exception as e:
             self.logger.error(f"Error fetching index information: {str(e)}")
-            return []
\ No newline at end of file
+            return {}
+
+        indexes: Dict[str, List[Dict[str, Any]]] = {table: [] for table in cache_key}
+        for table, name, columns, is_unique in results:
+            indexes[table].append({
+                'name': name,
+                'columns': columns,
+                'unique': is_unique
+            })
+        self._index_cache[cache_key] = indexes
+        return indexes
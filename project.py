@@ -1,9 +1,9 @@
 import sys
 import logging
-from typing import Optional
-from interface import QueryPlanAnalyzer
-from preprocessing import QueryPreprocessor, DatabaseConfig
-from whatif import QueryPlanModifier
+import logging.handlers
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
 
 class QueryPlanAnalysisSystem:
     def __init__(self):
@@ -11,21 +11,34 @@ class QueryPlanAnalysisSystem:
         self.preprocessor = None
         self.modifier = None
         self.gui = None
+        self._worker_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="plan-worker")
+        self._current_sql: Optional[str] = None
 
     def _setup_logging(self):
+        # Log calls only enqueue; a background listener does the file/stdout I/O
+        # so the Tk thread never blocks on disk writes
+        log_queue = queue.Queue(-1)
+        self._log_queue_handler = logging.handlers.QueueHandler(log_queue)
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('query_analysis.log'),
-                logging.StreamHandler(sys.stdout)
-            ]
+            handlers=[self._log_queue_handler],
+            force=True
         )
+        self.log_listener = logging.handlers.QueueListener(
+            log_queue,
+            logging.FileHandler('query_analysis.log'),
+            logging.StreamHandler(sys.stdout)
+        )
+        self.log_listener.start()
         self.logger = logging.getLogger(__name__)
 
     def initialize(self):
         """Initialize the system components"""
         try:
+            # Deferred so Tk/psycopg2 load after logging is configured
+            from interface import QueryPlanAnalyzer
+            
             # Create GUI first - it will handle login
             self.gui = QueryPlanAnalyzer()
             
@@ -41,20 +54,11 @@ class QueryPlanAnalysisSystem:
     def post_login_setup(self, connection):
         """Setup components after successful database connection"""
         try:
-            # Create DatabaseConfig from successful connection
-            config = DatabaseConfig(
-                host=connection.info.host,
-                port=connection.info.port,
-                dbname=connection.info.dbname,
-                user=connection.info.user,
-                password=connection.info.password
-            )
-            
-            # Initialize preprocessor with existing connection
-            self.preprocessor = QueryPreprocessor(config)
-            self.preprocessor.connection = connection
+            # Share the GUI's preprocessor so both use the same plan cache
+            self.preprocessor = self.gui.preprocessor
             
             # Initialize plan modifier
+            from whatif import QueryPlanModifier
             self.modifier = QueryPlanModifier()
             
             # Setup event handlers
@@ -64,46 +68,141 @@ class QueryPlanAnalysisSystem:
 
         except Exception as e:
             self.logger.error(f"Error during post-login setup: {str(e)}")
-            self.gui.show_error(f"Error during setup: {str(e)}")
+            from tkinter import messagebox
+            messagebox.showerror("Error", f"Error during setup: {str(e)}")
 
     def _setup_event_handlers(self):
         """Connect GUI events to their handlers"""
         if not self.gui:
             return
 
-        # Connect GUI events to corresponding methods
-        self.gui.bind('<Generate>', self.handle_generate_plan)
-        self.gui.bind('<OperatorChange>', self.handle_operator_modification)
-        self.gui.bind('<JoinOrderChange>', self.handle_join_order_modification)
-        self.gui.bind('<Reset>', self.handle_reset)
+        # Connect GUI events to corresponding methods; Tk only accepts virtual
+        # event names here, and the handlers read their input from the widgets
+        self.gui.bind('<<Generate>>', lambda event: self.handle_generate_plan(
+            self.gui.query_text.get("1.0", "end").strip()
+        ))
+        self.gui.bind('<<OperatorChange>>', lambda event: self.handle_operator_modification(
+            *self.gui.selected_operator_edit()
+        ))
 
     def handle_generate_plan(self, sql: str) -> None:
         """Handle generation of initial query plan"""
-        try:
+        # Database round trips and plan analysis run on a worker; the result is
+        # applied back on the Tk thread
+        future = self._worker_pool.submit(self._compute_plan, sql)
+        future.add_done_callback(
+            lambda f: self.gui.after(0, self._apply_plan, sql, f)
+        )
+
+    def _compute_plan(self, sql: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[str]]:
+        """Worker: return (plan, metrics, error) for sql"""
+        # The preprocessor's connection is shared with the GUI. Repeat submissions
+        # are served by its caches, which honour both the schema fingerprint and
+        # replan_interval: validity verdicts, plans, complexity metrics and indexes
+        with self.gui.db_lock:
             # Validate SQL
             is_valid, error = self.preprocessor.validate_sql(sql)
             if not is_valid:
-                self.gui.show_error(f"Invalid SQL: {error}")
-                return
+                return None, None, error
             
             # Get initial query plan
             initial_plan = self.preprocessor.get_query_plan(sql)
             
             # Analyze plan complexity
             complexity_metrics = self.preprocessor.analyze_query_complexity(initial_plan)
+            complexity_metrics['indexes'] = self.preprocessor.get_all_indexes(
+                complexity_metrics['tables_involved']
+            )
+            return initial_plan, complexity_metrics, None
+
+    def _apply_plan(self, sql: str, future: Future) -> None:
+        """Tk thread: push a computed plan into the modifier and the GUI"""
+        from tkinter import messagebox
+        
+        try:
+            initial_plan, complexity_metrics, error = future.result()
+            if error is not None:
+                messagebox.showerror("Error", f"Invalid SQL: {error}")
+                return
             
             # Set up the plan modifier
             self.modifier.set_original_plan(initial_plan)
+            self._current_sql = sql
             
-            # Update GUI with plan and metrics
-            self.gui.update_plan_visualization(initial_plan)
+            # Update GUI with the _nid-stamped plan so its node ids match the modifier's
+            self.gui.qep_data = self.modifier.original_plan
+            self.gui.visualize_plan(self.gui.qep_data, is_qep=True)
+            self.gui.update_cost_labels()
             self.gui.update_metrics_display(complexity_metrics)
             
             self.logger.info("Query plan generated successfully")
+            
+            # Warm the plan cache with the join swaps the user is likely to try next
+            self._prefetch_join_variants(sql, self.modifier.original_plan)
 
         except Exception as e:
             self.logger.error(f"Error generating query plan: {str(e)}")
-            self.gui.show_error(f"Error generating plan: {str(e)}")
+            messagebox.showerror("Error", f"Error generating plan: {str(e)}")
+
+        finally:
+            self.gui.generate_btn.state(['!disabled'])
+
+    def _prefetch_join_variants(self, sql: str, plan: Dict[str, Any]) -> None:
+        """Speculatively plan every alternative join algorithm for each join node"""
+        from preprocessing import JoinType, JOIN_TYPES
+        from whatif import PlanModification, affected_tables
+        
+        # Each variant is exactly the SQL a single operator edit of that join
+        # produces, so handle_operator_modification finds it in the plan cache
+        variants = []
+        stack = [plan['Plan']]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.get('Plans', []))
+            if node.get('Node Type') not in JOIN_TYPES:
+                continue
+
+            tables = affected_tables(node)
+            for join_type in JoinType:
+                if join_type.value == node['Node Type']:
+                    continue
+                modification = PlanModification(
+                    node_id=str(node['_nid']),
+                    current_type=node['Node Type'],
+                    target_type=join_type.value,
+                    affected_tables=tables
+                )
+                variants.append(self.modifier.generate_modified_sql(sql, [modification]))
+
+        self.preprocessor.prefetch_query_plans(variants)
+
+    def handle_operator_modification(self, node_id: str, new_type: str) -> None:
+        """Apply an operator edit and plan the resulting AQP off the Tk thread"""
+        if self._current_sql is None or not self.modifier.modify_operator(node_id, new_type):
+            return
+        
+        modified_sql = self.modifier.generate_modified_sql(self._current_sql)
+        future = self._worker_pool.submit(self._compute_modified_plan, modified_sql)
+        future.add_done_callback(
+            lambda f: self.gui.after(0, self._apply_modified_plan, f)
+        )
+
+    def _compute_modified_plan(self, modified_sql: str) -> Dict[str, Any]:
+        """Worker: plan the hinted query; prefetched join swaps come from the plan cache"""
+        with self.gui.db_lock:
+            return self.preprocessor.get_query_plan(modified_sql)
+
+    def _apply_modified_plan(self, future: Future) -> None:
+        """Tk thread: show the alternative plan next to the original"""
+        from tkinter import messagebox
+        
+        try:
+            self.gui.aqp_data = future.result()
+            self.gui.visualize_plan(self.gui.aqp_data, is_qep=False)
+            self.gui.update_cost_labels()
+        except Exception as e:
+            self.logger.error(f"Error generating modified plan: {str(e)}")
+            messagebox.showerror("Error", f"Error generating modified plan: {str(e)}")
 
     def run(self):
         """Run the application"""
@@ -125,6 +224,11 @@ class QueryPlanAnalysisSystem:
     def cleanup(self):
         """Clean up resources"""
         try:
+            # cancel_futures is only understood from Python 3.9 on
+            if sys.version_info >= (3, 9):
+                self._worker_pool.shutdown(wait=False, cancel_futures=True)
+            else:
+                self._worker_pool.shutdown(wait=False)
             if self.preprocessor:
                 self.preprocessor.disconnect()
             self.logger.info("Cleanup completed successfully")
@@ -132,6 +236,18 @@ class QueryPlanAnalysisSystem:
         except Exception as e:
             self.logger.error(f"Error during cleanup: {str(e)}")
 
+        finally:
+            # Flushes any queued records before returning
+            self.log_listener.stop()
+            
+            # Nothing drains the queue any more: log straight to the file/stdout so
+            # later records (startup failures, the pool closing at exit) survive
+            root = logging.getLogger()
+            root.removeHandler(self._log_queue_handler)
+            for handler in self.log_listener.handlers:
+                handler.setFormatter(self._log_queue_handler.formatter)
+                root.addHandler(handler)
+
 if __name__ == "__main__":
     try:
         # Create and run the application
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from preprocessing import DatabaseConfig, QueryPreprocessor, normalize_sql
+
+
+def test_normalize_folds_keywords_and_whitespace():
+    assert normalize_sql("SELECT  *\n FROM  T") == normalize_sql("select * from t")
+
+
+def test_normalize_keeps_quoted_identifiers_and_literals():
+    assert normalize_sql("SELECT * FROM \"Orders\" WHERE n = 'Alice'") != \
+        normalize_sql("select * from \"orders\" where n = 'alice'")
+
+
+def test_normalize_keeps_dollar_quoted_strings():
+    assert normalize_sql("SELECT $$A$$") != normalize_sql("SELECT $$a$$")
+    assert normalize_sql("SELECT $q$A  B$q$") == "select $q$A  B$q$"
+    # Positional parameters and identifiers containing $ are not dollar quotes
+    assert normalize_sql("SELECT A$B$C FROM T WHERE X = $1") == "select a$b$c from t where x = $1"
+
+
+def test_normalize_keeps_escape_strings_whole():
+    assert normalize_sql(r"SELECT E'It\'s  ABC' FROM T") == r"select E'It\'s  ABC' from t"
+    assert normalize_sql(r"SELECT E'It\'s ABC'") != normalize_sql(r"SELECT E'It\'s abc'")
+
+
+def test_plan_cache_key_ignores_explain_prefix():
+    assert QueryPreprocessor._plan_cache_key("EXPLAIN ANALYZE SELECT 1") == \
+        QueryPreprocessor._plan_cache_key("select 1")
+
+
+def _left_deep_plan(joins):
+    node = {'Node Type': 'Seq Scan', 'Relation Name': 't0', 'Total Cost': 1.0}
+    for i in range(1, joins + 1):
+        node = {
+            'Node Type': 'Hash Join',
+            'Total Cost': float(i + 1),
+            'Plans': [node, {'Node Type': 'Seq Scan', 'Relation Name': f't{i}', 'Total Cost': 1.0}],
+        }
+    return {'Plan': node}
+
+
+def test_analyze_query_complexity_counts_and_memoizes():
+    preprocessor = QueryPreprocessor(DatabaseConfig('localhost', 5432, 'db', 'user', ''))
+    plan = _left_deep_plan(500)
+
+    metrics = preprocessor.analyze_query_complexity(plan)
+    assert metrics['number_of_joins'] == 500
+    assert len(metrics['scan_types']) == 501
+    assert metrics['total_cost'] == 501.0
+    assert len(metrics['tables_involved']) == 501
+
+    # Callers may decorate the result without corrupting the memoized copy
+    metrics['join_types'].clear()
+    metrics['indexes'] = {}
+    again = preprocessor.analyze_query_complexity(plan)
+    assert len(again['join_types']) == 500
+    assert 'indexes' not in again
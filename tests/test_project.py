@@ -0,0 +1,120 @@
+from concurrent.futures import Future
+
+import pytest
+
+tk = pytest.importorskip("tkinter")
+pytest.importorskip("psycopg2")
+pytest.importorskip("networkx")
+pytest.importorskip("matplotlib")
+
+from tkinter import messagebox
+
+from project import QueryPlanAnalysisSystem
+from whatif import QueryPlanModifier
+
+PLAN = {
+    'Plan': {
+        'Node Type': 'Hash Join',
+        'Total Cost': 120.0,
+        'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'orders', 'Total Cost': 40.0},
+            {
+                'Node Type': 'Hash',
+                'Total Cost': 60.0,
+                'Plans': [{'Node Type': 'Seq Scan', 'Relation Name': 'lineitem', 'Total Cost': 60.0}],
+            },
+        ],
+    }
+}
+
+METRICS = {
+    'join_types': ['Hash Join'],
+    'scan_types': ['Seq Scan', 'Seq Scan'],
+    'total_cost': 120.0,
+    'number_of_joins': 1,
+    'tables_involved': ['orders', 'lineitem'],
+    'indexes': {'orders': [{'name': 'orders_pkey', 'columns': ['o_orderkey'], 'unique': True}]},
+}
+
+
+class RecordingPreprocessor:
+    """Stands in for the database side only; records the queries it is asked to plan"""
+
+    def __init__(self):
+        self.prefetched = []
+        self.planned = []
+
+    def prefetch_query_plans(self, sqls):
+        self.prefetched.extend(sqls)
+
+    def get_query_plan(self, sql):
+        self.planned.append(sql)
+        return {'Plan': {'Node Type': 'Merge Join', 'Total Cost': 90.0}}
+
+
+@pytest.fixture
+def gui():
+    from interface import QueryPlanAnalyzer
+
+    try:
+        window = QueryPlanAnalyzer()
+    except tk.TclError:
+        pytest.skip("no display available")
+    window.login_window.destroy()
+    window.create_widgets()
+    yield window
+    window.destroy()
+
+
+@pytest.fixture
+def app(gui, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    system = QueryPlanAnalysisSystem()
+    system.gui = gui
+    system.modifier = QueryPlanModifier()
+    system.preprocessor = RecordingPreprocessor()
+    yield system
+    system._worker_pool.shutdown(wait=True)
+    system.log_listener.stop()
+
+
+@pytest.fixture
+def errors(monkeypatch):
+    shown = []
+    monkeypatch.setattr(messagebox, 'showerror', lambda *args: shown.append(args))
+    return shown
+
+
+def test_apply_plan_updates_the_real_gui(app, errors):
+    future = Future()
+    future.set_result((PLAN, METRICS, None))
+
+    app._apply_plan("SELECT * FROM orders JOIN lineitem ON true", future)
+
+    assert errors == []
+    assert app.gui.qep_data['Plan']['_nid'] == 0
+    assert "Joins: 1" in app.gui.metrics_label.cget('text')
+    assert "Indexes: 1" in app.gui.metrics_label.cget('text')
+    # Reaching the end of _apply_plan kicks off the join-swap prefetch
+    assert len(app.preprocessor.prefetched) == 2
+
+
+def test_operator_edit_control_plans_a_prefetched_variant(app, errors):
+    app._setup_event_handlers()
+    future = Future()
+    future.set_result((PLAN, METRICS, None))
+    app._apply_plan("SELECT * FROM orders JOIN lineitem ON true", future)
+
+    # Drive the edit through the GUI control and its <<OperatorChange>> binding
+    assert "0: Hash Join" in app.gui.operator_node.cget('values')
+    app.gui.operator_node.set("0: Hash Join")
+    app.gui.operator_type.set("Merge Join")
+    app.gui.request_operator_change()
+
+    app._worker_pool.shutdown(wait=True)
+    app.gui.update()
+
+    assert errors == []
+    assert len(app.preprocessor.planned) == 1
+    assert app.preprocessor.planned[0] in app.preprocessor.prefetched
+    assert app.gui.aqp_data['Plan']['Node Type'] == 'Merge Join'
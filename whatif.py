@@ -1,60 +1,188 @@
 from typing import Dict, Any, List, Optional, Tuple
-import copy
+import itertools
 import logging
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, replace
 from enum import Enum
+from preprocessing import JOIN_TYPES
 
 class PlannerMethod(Enum):
     ENABLE_HASHJOIN = "enable_hashjoin"
     ENABLE_MERGEJOIN = "enable_mergejoin"
     ENABLE_NESTLOOP = "enable_nestloop"
     ENABLE_INDEXSCAN = "enable_indexscan"
+    ENABLE_INDEXONLYSCAN = "enable_indexonlyscan"
     ENABLE_SEQSCAN = "enable_seqscan"
     ENABLE_BITMAPSCAN = "enable_bitmapscan"
 
-@dataclass
+# Every planner method enabled; copied as the starting point for each hint set
+_DEFAULT_HINTS = {method.value: True for method in PlannerMethod}
+
+# Plan node type -> planner flag that controls it
+_TYPE_TO_FLAG = {
+    'Hash Join': PlannerMethod.ENABLE_HASHJOIN.value,
+    'Merge Join': PlannerMethod.ENABLE_MERGEJOIN.value,
+    'Nested Loop': PlannerMethod.ENABLE_NESTLOOP.value,
+    'Index Scan': PlannerMethod.ENABLE_INDEXSCAN.value,
+    'Index Only Scan': PlannerMethod.ENABLE_INDEXONLYSCAN.value,
+    'Seq Scan': PlannerMethod.ENABLE_SEQSCAN.value,
+    'Bitmap Heap Scan': PlannerMethod.ENABLE_BITMAPSCAN.value,
+    'Bitmap Index Scan': PlannerMethod.ENABLE_BITMAPSCAN.value,
+}
+
+# Plan node type -> pg_hint_plan hint name
+_TYPE_TO_HINTNAME = {
+    'Hash Join': 'HashJoin',
+    'Merge Join': 'MergeJoin',
+    'Nested Loop': 'NestLoop',
+    'Index Scan': 'IndexScan',
+    'Index Only Scan': 'IndexOnlyScan',
+    'Seq Scan': 'SeqScan',
+    'Bitmap Heap Scan': 'BitmapScan',
+    'Bitmap Index Scan': 'BitmapScan',
+}
+
+# Ready-made '%s'-templates per node type, e.g. 'Hash Join' -> 'HashJoin(%s) ',
+# filled with the modification's affected_tables
+_HINT_TEMPLATES = {node_type: f"{name}(%s) " for node_type, name in _TYPE_TO_HINTNAME.items()}
+
+def affected_tables(node: Dict[str, Any]) -> Tuple[str, ...]:
+    """Relations a hint for this node must name: all relations under a join, else its own"""
+    if node.get('Node Type') not in JOIN_TYPES:
+        relation = node.get('Relation Name')
+        return (relation,) if relation else ()
+
+    # Sorted so the hint text does not depend on the current child order
+    tables = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if 'Relation Name' in current:
+            tables.append(current['Relation Name'])
+        stack.extend(current.get('Plans', ()))
+    return tuple(sorted(tables))
+
+def _fast_clone(o: Any) -> Any:
+    """Deep-copy JSON-shaped data; much cheaper than copy.deepcopy for EXPLAIN trees"""
+    if isinstance(o, dict):
+        return {k: _fast_clone(v) for k, v in o.items()}
+    if isinstance(o, list):
+        return [_fast_clone(v) for v in o]
+    return o
+
+# slots= needs Python 3.10; older interpreters just get a regular frozen dataclass
+_DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(frozen=True, **_DATACLASS_SLOTS)
 class PlanModification:
     node_id: str
     current_type: str
     target_type: str
-    affected_tables: List[str]
+    affected_tables: Tuple[str, ...]
 
 class QueryPlanModifier:
+    """Applies what-if edits to a copy of a query plan.
+
+    Node id contract: set_original_plan stamps every plan node with an integer
+    '_nid' (preorder, root is 0). The ids are carried into modified_plan and stay
+    valid across modifications and resets, so callers should pass node['_nid']
+    (as int or str) to modify_operator / modify_join_order.
+    """
+
+    __slots__ = (
+        'logger',
+        'original_plan',
+        '_modified_plan_cache',
+        '_modified_dirty',
+        '_node_index_by_nid',
+        '_mods_by_node',
+        '_join_swaps',
+    )
+
     def __init__(self):
-        self._setup_logging()
-        self.original_plan = None
-        self.modified_plan = None
-        self.modifications = []
-
-    def _setup_logging(self):
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        # Logging is configured once by the application, not per instance
         self.logger = logging.getLogger(__name__)
+        self.original_plan = None
+        self._modified_plan_cache = None
+        self._modified_dirty = False
+        self._node_index_by_nid: Dict[int, Tuple[Dict[str, Any], Optional[Dict[str, Any]]]] = {}
+        # At most one net modification per node, keyed by node id
+        self._mods_by_node: Dict[str, PlanModification] = {}
+        # (siblings list, index a, index b) for every join swap, for undo on reset
+        self._join_swaps: List[Tuple[List[Dict[str, Any]], int, int]] = []
+
+    @property
+    def modifications(self) -> List[PlanModification]:
+        """Net operator modifications, one per edited node, in first-edit order"""
+        return list(self._mods_by_node.values())
+
+    @property
+    def modified_plan(self) -> Optional[Dict[str, Any]]:
+        """The modified plan; shares the original tree until the first modification"""
+        return self._modified_plan_cache
+
+    def _writable_modified_plan(self) -> Dict[str, Any]:
+        """Copy-on-write: give the modified plan its own tree before mutating it"""
+        if not self._modified_dirty:
+            self._modified_plan_cache = _fast_clone(self.original_plan)
+            self._modified_dirty = True
+            self._build_node_index(self._modified_plan_cache)
+        return self._modified_plan_cache
+
+    def _build_node_index(self, plan: Dict[str, Any]) -> None:
+        """Map _nid -> (node, parent) for every node of the given plan tree"""
+        root = plan['Plan']
+        index = {root['_nid']: (root, None)}
+        
+        # Children are indexed as they are pushed, so the stack only holds nodes;
+        # bound push/pop and no per-node generator keep the loop tight
+        stack = [root]
+        push, pop = stack.append, stack.pop
+        while stack:
+            node = pop()
+            children = node.get('Plans')
+            if children:
+                for child in children:
+                    index[child['_nid']] = (child, node)
+                    push(child)
+        self._node_index_by_nid = index
+
+    @staticmethod
+    def _assign_node_ids(plan: Dict[str, Any]) -> None:
+        """Stamp each node with a stable preorder integer id under '_nid'"""
+        counter = itertools.count()
+        stack = [plan['Plan']]
+        while stack:
+            node = stack.pop()
+            node['_nid'] = next(counter)
+            stack.extend(reversed(node.get('Plans', ())))
 
     def set_original_plan(self, plan: Dict[str, Any]) -> None:
         """Store the original query plan"""
-        self.original_plan = copy.deepcopy(plan)
-        self.modified_plan = copy.deepcopy(plan)
+        self.original_plan = _fast_clone(plan)
+        self._assign_node_ids(self.original_plan)
+        self._modified_plan_cache = self.original_plan
+        self._modified_dirty = False
+        self._node_index_by_nid = {}
+        # Edits recorded against a previous plan no longer apply
+        self._mods_by_node = {}
+        self._join_swaps = []
 
     def generate_planner_hints(self, modifications: List[PlanModification]) -> Dict[str, bool]:
         """Generate PostgreSQL planner method settings based on desired modifications"""
-        hints = {method.value: True for method in PlannerMethod}
+        hints = _DEFAULT_HINTS.copy()
         
         for mod in modifications:
             if mod.current_type != mod.target_type:
                 # Disable current operation type
-                if "Join" in mod.current_type:
-                    hints[f"enable_{mod.current_type.lower().replace(' ', '')}"] = False
-                elif "Scan" in mod.current_type:
-                    hints[f"enable_{mod.current_type.lower().replace(' ', '')}"] = False
+                flag = _TYPE_TO_FLAG.get(mod.current_type)
+                if flag:
+                    hints[flag] = False
                 
                 # Enable target operation type
-                if "Join" in mod.target_type:
-                    hints[f"enable_{mod.target_type.lower().replace(' ', '')}"] = True
-                elif "Scan" in mod.target_type:
-                    hints[f"enable_{mod.target_type.lower().replace(' ', '')}"] = True
+                flag = _TYPE_TO_FLAG.get(mod.target_type)
+                if flag:
+                    hints[flag] = True
         
         return hints
 
@@ -63,37 +191,36 @@ class QueryPlanModifier:
         if not self.modified_plan:
             return False
 
-        def find_node(plan: Dict[str, Any], node_id: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
-            """Find a node and its parent in the plan tree"""
-            def traverse(node: Dict[str, Any], parent: Optional[Dict[str, Any]] = None):
-                if id(node) == int(node_id):
-                    return node, parent
-                for child in node.get('Plans', []):
-                    result = traverse(child, node)
-                    if result[0]:
-                        return result
-                return None, None
-
-            return traverse(plan['Plan'])
+        self._writable_modified_plan()
 
         try:
-            # Collect all nodes
+            # Convert the GUI's ids once, then collect all nodes
+            targets = [int(node_id) for node_id in node_ids]
             nodes = []
             parents = []
-            for node_id in node_ids:
-                node, parent = find_node(self.modified_plan, node_id)
-                if node:
-                    nodes.append(node)
-                    parents.append(parent)
-                else:
+            for target in targets:
+                entry = self._node_index_by_nid.get(target)
+                if entry is None:
                     return False
+                node, parent = entry
+                nodes.append(node)
+                parents.append(parent)
 
-            # Perform the reordering
+            # Swap adjacent siblings in place under their shared parent; pairs
+            # that live under different parents cannot be exchanged and are skipped
+            swapped = False
             for i in range(len(nodes) - 1):
-                nodes[i]['Plans'], nodes[i + 1]['Plans'] = \
-                    nodes[i + 1]['Plans'], nodes[i]['Plans']
+                parent = parents[i]
+                if parent is None or parent is not parents[i + 1]:
+                    continue
+                siblings = parent['Plans']
+                ia = next(j for j, child in enumerate(siblings) if child is nodes[i])
+                ib = next(j for j, child in enumerate(siblings) if child is nodes[i + 1])
+                siblings[ia], siblings[ib] = siblings[ib], siblings[ia]
+                self._join_swaps.append((siblings, ia, ib))
+                swapped = True
 
-            return True
+            return swapped
         except Exception as e:
             self.logger.error(f"Error modifying join order: {str(e)}")
             return False
@@ -103,79 +230,107 @@ class QueryPlanModifier:
         if not self.modified_plan:
             return False
 
-        def traverse_and_modify(node: Dict[str, Any]) -> bool:
-            if id(node) == int(node_id):
-                old_type = node['Node Type']
-                node['Node Type'] = new_type
-                self.modifications.append(
-                    PlanModification(
-                        node_id=node_id,
-                        current_type=old_type,
-                        target_type=new_type,
-                        affected_tables=[node.get('Relation Name')] if 'Relation Name' in node else []
-                    )
-                )
-                return True
-                
-            for child in node.get('Plans', []):
-                if traverse_and_modify(child):
-                    return True
-            return False
+        self._writable_modified_plan()
 
         try:
-            return traverse_and_modify(self.modified_plan['Plan'])
+            target = int(node_id)
+            entry = self._node_index_by_nid.get(target)
+            if entry is None:
+                return False
+
+            node, _ = entry
+            key = str(target)
+            prev = self._mods_by_node.get(key)
+            if prev is None:
+                mod = PlanModification(
+                    node_id=key,
+                    current_type=node['Node Type'],
+                    target_type=new_type,
+                    affected_tables=affected_tables(node)
+                )
+            else:
+                # Coalesce repeated edits of a node, keeping the planner's type as anchor
+                mod = replace(prev, target_type=new_type)
+            node['Node Type'] = new_type
+
+            if mod.current_type == mod.target_type:
+                # Edited back to the original operator: nothing left to hint
+                self._mods_by_node.pop(key, None)
+            else:
+                self._mods_by_node[key] = mod
+            return True
         except Exception as e:
             self.logger.error(f"Error modifying operator: {str(e)}")
             return False
 
-    def generate_modified_sql(self, original_sql: str) -> str:
-        """Generate modified SQL with planner hints"""
-        hints = self.generate_planner_hints(self.modifications)
-        hint_string = "/*+ "
-        
-        # Add join hints
-        for mod in self.modifications:
-            if "Join" in mod.target_type:
-                hint_string += f"{mod.target_type.replace(' ', '')}({','.join(mod.affected_tables)}) "
-        
-        # Add scan hints
-        for mod in self.modifications:
-            if "Scan" in mod.target_type:
-                hint_string += f"{mod.target_type.replace(' ', '')}({mod.affected_tables[0]}) "
+    def generate_modified_sql(self, original_sql: str,
+                              modifications: Optional[List[PlanModification]] = None) -> str:
+        """Generate modified SQL with planner hints (defaults to the recorded modifications)"""
+        if modifications is None:
+            modifications = self.modifications
+        parts = ["/*+ "]
         
-        hint_string += "*/ "
+        # Join and scan hints in one pass; pg_hint_plan does not care about their order
+        for mod in modifications:
+            # No-op edits (type set back to what the planner chose) need no hint
+            if mod.current_type == mod.target_type:
+                continue
+            # Nodes without a relation of their own (Bitmap Index, CTE and Subquery
+            # Scans) cannot be named in a hint, so they are left to the planner
+            template = _HINT_TEMPLATES.get(mod.target_type)
+            if template and mod.affected_tables:
+                parts.append(template % ",".join(mod.affected_tables))
         
-        return hint_string + original_sql
+        parts.append("*/ ")
+        parts.append(original_sql)
+        return "".join(parts)
 
     def reset_modifications(self) -> None:
-        """Reset all modifications"""
-        self.modified_plan = copy.deepcopy(self.original_plan)
-        self.modifications = []
+        """Reset all modifications by undoing them on the modified copy"""
+        # Unwind join swaps newest-first, then restore each edited node's original
+        # type; the private copy and its index stay valid for the next edit
+        for siblings, ia, ib in reversed(self._join_swaps):
+            siblings[ia], siblings[ib] = siblings[ib], siblings[ia]
+        for mod in self._mods_by_node.values():
+            node, _ = self._node_index_by_nid[int(mod.node_id)]
+            node['Node Type'] = mod.current_type
+        self._join_swaps = []
+        self._mods_by_node = {}
 
     def compare_plans(self) -> Dict[str, Any]:
         """Compare original and modified plans"""
         if not self.original_plan or not self.modified_plan:
             return {}
 
-        def extract_metrics(plan: Dict[str, Any]) -> Dict[str, Any]:
-            return {
-                'total_cost': plan['Plan'].get('Total Cost', 0),
-                'startup_cost': plan['Plan'].get('Startup Cost', 0),
-                'plan_rows': plan['Plan'].get('Plan Rows', 0),
-                'plan_width': plan['Plan'].get('Plan Width', 0)
-            }
+        def extract_metrics(plan: Dict[str, Any]) -> Tuple[float, float, int, int]:
+            root = plan['Plan']
+            return (
+                root.get('Total Cost', 0.0),
+                root.get('Startup Cost', 0.0),
+                root.get('Plan Rows', 0),
+                root.get('Plan Width', 0)
+            )
 
-        original_metrics = extract_metrics(self.original_plan)
-        modified_metrics = extract_metrics(self.modified_plan)
-
-        comparison = {
-            'cost_difference': modified_metrics['total_cost'] - original_metrics['total_cost'],
-            'cost_percentage': (
-                (modified_metrics['total_cost'] - original_metrics['total_cost']) 
-                / original_metrics['total_cost'] * 100
-            ),
-            'original_metrics': original_metrics,
-            'modified_metrics': modified_metrics
-        }
+        o_tc, o_sc, o_pr, o_pw = extract_metrics(self.original_plan)
+        m_tc, m_sc, m_pr, m_pw = extract_metrics(self.modified_plan)
+
+        # Zero-cost roots (e.g. a bare Result node) have no meaningful percentage
+        cost_difference = m_tc - o_tc
+        cost_percentage = 0.0 if o_tc == 0 else cost_difference / o_tc * 100.0
 
-        return comparison
\ No newline at end of file
+        return {
+            'cost_difference': cost_difference,
+            'cost_percentage': cost_percentage,
+            'original_metrics': {
+                'total_cost': o_tc,
+                'startup_cost': o_sc,
+                'plan_rows': o_pr,
+                'plan_width': o_pw
+            },
+            'modified_metrics': {
+                'total_cost': m_tc,
+                'startup_cost': m_sc,
+                'plan_rows': m_pr,
+                'plan_width': m_pw
+            }
+        }